@@ -10,7 +10,6 @@ from __future__ import absolute_import, unicode_literals
 import datetime
 import hashlib
 import inspect
-import json
 import os
 import pprint
 import re
@@ -26,6 +25,11 @@ try:
 except ImportError:
     import pickle
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 import pywikibot
 
 from pywikibot import config, login
@@ -1980,7 +1984,7 @@ class Request(MutableMapping):
             if rawdata.startswith(u"unknown_action"):
                 raise APIError(rawdata[:14], rawdata[16:])
             try:
-                result = json.loads(rawdata)
+                result = json_loads(rawdata)
             except ValueError:
                 # if the result isn't valid JSON, there must be a server
                 # problem. Wait a few seconds and try again
@@ -1715,6 +1715,134 @@ def extract_templates_and_params_regex_simple(text):
     return result
 
 
+# Tokens which matter for splitting template params
+_TEMPLATE_TOKEN_REGEX = re.compile(
+    r'\{\{\{|\}\}\}|\{\{|\}\}|\[\[|\]\]|[|=]|'
+    r'<(?P<closing>/?)(?P<tag>[a-zA-Z][\w-]*)[^<>]*?(?P<selfclosing>/?)>')
+
+_template_title_regexes = {}
+
+
+def _template_title_regex(titles):
+    """Return a regex matching the start of templates with the titles."""
+    titles = frozenset(titles)
+    if titles not in _template_title_regexes:
+        # Any namespace prefix is accepted, spaces may be written as
+        # underscores and the first letter may have any case. Template
+        # parameters like {{{Foo|x}}} are not templates.
+        _template_title_regexes[titles] = re.compile(
+            r'(?<!\{)\{\{\s*((?:[^{}|\[\]<>:]*:)*\s*(?:%s))\s*(?=\||\}\})'
+            % '|'.join('[ _]+'.join(re.escape(word) for word in title.split())
+                       for title in titles), re.I)
+    return _template_title_regexes[titles]
+
+
+def _split_template_params(text, start):
+    """
+    Split the params of a template at the top-level pipes.
+
+    @param text: wikitext containing the template
+    @param start: position after the pipe following the template name
+    @return: list of start, end and position of the first top-level '='
+        or None of each param, or None if the template is not closed
+    @rtype: list of tuple or None
+    """
+    parts = []
+    stack = []
+    equals = None
+    pos = start
+    while True:
+        token = _TEMPLATE_TOKEN_REGEX.search(text, pos)
+        if not token:
+            return None
+
+        delimiter = token.group()
+        pos = token.end()
+        if token.group('tag'):
+            if not token.group('closing') and not token.group('selfclosing'):
+                # The content of a tag doesn't split params
+                closing = re.compile(
+                    r'</%s\s*>' % re.escape(token.group('tag')),
+                    re.I).search(text, pos)
+                if closing:
+                    pos = closing.end()
+        elif delimiter in ('{{{', '{{', '[['):
+            stack.append(delimiter)
+        elif delimiter == '}}}' and stack and stack[-1] == '{{{':
+            stack.pop()
+        elif delimiter in ('}}}', '}}'):
+            if delimiter == '}}}':
+                # only '}}' closes a template, the last brace is text
+                pos -= 1
+            if not stack:
+                parts.append((start, token.start(), equals))
+                return parts
+            if stack[-1] == '{{':
+                stack.pop()
+        elif delimiter == ']]':
+            if stack and stack[-1] == '[[':
+                stack.pop()
+        elif stack:
+            continue
+        elif delimiter == '|':
+            parts.append((start, token.start(), equals))
+            start = pos
+            equals = None
+        elif equals is None:
+            equals = token.start()
+
+
+def extract_templates_and_params_by_title(text, titles,
+                                          remove_disabled_parts=True):
+    """
+    Extract templates with the given titles and their params.
+
+    Instead of parsing the whole text only the templates starting with
+    one of the titles are scanned, which is much faster when only a few
+    templates are of interest. The result equals the templates with
+    these titles returned by L{extract_templates_and_params} with
+    remove_disabled_parts and strip enabled.
+
+    Templates are matched with any namespace prefix, like 'Template:' or
+    'subst:', so the returned names should be checked by the caller.
+
+    @param text: The wikitext from which templates are extracted
+    @type text: unicode or string
+    @param titles: titles of the templates without namespace
+    @type titles: iterable of unicode
+    @param remove_disabled_parts: Remove disabled wikitext such as comments
+        and pre.
+    @type remove_disabled_parts: bool
+    @return: list of template name and params
+    @rtype: list of tuple of name and OrderedDict
+    @raises ValueError: a template is not closed
+    """
+    if remove_disabled_parts:
+        text = removeDisabledParts(text)
+
+    result = []
+    for match in _template_title_regex(titles).finditer(text):
+        parts = []
+        if text.startswith('|', match.end()):
+            parts = _split_template_params(text, match.end() + 1)
+            if parts is None:
+                raise ValueError('Template %s is not closed.'
+                                 % match.group(1))
+
+        params = OrderedDict()
+        position = 0
+        for start, end, equals in parts:
+            if equals is None:
+                position += 1
+                params[str(position)] = text[start:end]
+            else:
+                params[text[start:equals].strip()] = text[
+                    equals + 1:end].strip()
+        result.append((match.group(1), params))
+
+    return result
+
+
 def glue_template_and_params(template_and_params):
     """Return wiki text of template glued from params.
 
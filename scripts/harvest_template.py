@@ -85,25 +85,89 @@ Examples:
 from __future__ import absolute_import, unicode_literals
 
 import signal
+import sys
+import threading
+import time
 
-willstop = False
+import pywikibot
+from pywikibot import pagegenerators as pg, textlib
+from pywikibot.bot import WikidataBot, OptionHandler
+from pywikibot.data import api
+from pywikibot.tools import itergroup, OrderedDict, ThreadedGenerator
+
+if sys.version_info[0] > 2:
+    from queue import Empty
+else:
+    from Queue import Empty
+
+
+class _State(object):
+
+    """Whether the user asked the bot to stop."""
+
+    __slots__ = ('stop',)
+
+    def __init__(self):
+        """Constructor."""
+        self.stop = False
+
+
+_state = _State()
 
 
 def _signal_handler(signal, frame):
-    global willstop
-    if not willstop:
-        willstop = True
+    if not _state.stop:
+        _state.stop = True
         print('Received ctrl-c. Finishing current item; '
               'press ctrl-c again to abort.')
     else:
         raise KeyboardInterrupt
 
 
-signal.signal(signal.SIGINT, _signal_handler)
+class _PrefetchingGenerator(ThreadedGenerator):
+
+    """
+    Look-ahead generator which passes the generator's errors on.
+
+    Unlike ThreadedGenerator, an exception raised by the generator is
+    re-raised in the consumer instead of leaving it waiting forever, and
+    ctrl-c while waiting for the next value is not swallowed. The thread
+    doesn't keep the interpreter from exiting while it is preloading.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor."""
+        super(_PrefetchingGenerator, self).__init__(*args, **kwargs)
+        self.daemon = True
+        self.exception = None
+
+    def __iter__(self):
+        """Iterate results from the queue."""
+        if not self.is_alive() and not self.finished.is_set():
+            self.start()
+        try:
+            while not self.finished.is_set():
+                try:
+                    yield self.queue.get(True, 0.25)
+                except Empty:
+                    pass
+        finally:
+            self.stop()
+        if self.exception is not None:
+            raise self.exception
+
+    def run(self):
+        """Run the generator and store the results or its exception."""
+        try:
+            super(_PrefetchingGenerator, self).run()
+        except BaseException as e:
+            self.exception = e
+            # the values retrieved before the error may still be treated
+            while not self.finished.is_set() and not self.queue.empty():
+                time.sleep(0.25)
+        finally:
+            self.stop()
 
-import pywikibot
-from pywikibot import pagegenerators as pg, textlib
-from pywikibot.bot import WikidataBot, OptionHandler
 
 docuReplacements = {'&params;': pywikibot.pagegenerators.parameterHelp}
 
@@ -122,6 +186,15 @@ class HarvestRobot(WikidataBot):
 
     """A bot to add Wikidata claims."""
 
+    # how many pages and items are retrieved per API request, and with
+    # the apihighlimits right (e.g. bot accounts)
+    groupsize = 50
+    high_groupsize = 500
+    # how many pages may be fetched in advance of the page being treated
+    prefetch = 100
+    # how many resolved links and files are remembered during a run
+    link_cache_size = 50000
+
     def __init__(self, generator, templateTitle, fields, **kwargs):
         """
         Constructor.
@@ -147,6 +220,7 @@ class HarvestRobot(WikidataBot):
             'islink': False,
         })
         super(HarvestRobot, self).__init__(**kwargs)
+        self._state = _state
         self.generator = generator
         self.templateTitle = templateTitle.replace(u'_', u' ')
         # TODO: Make it a list which also includes the redirects to the template
@@ -156,13 +230,61 @@ class HarvestRobot(WikidataBot):
                 self.fields[key] = value
             else:  # backwards compatibility
                 self.fields[key] = (value, PropertyOptionHandler())
-        self.cacheSources()
-        self.templateTitles = self.getTemplateSynonyms(self.templateTitle)
+        # Pages whose item has all these properties can be skipped, unless
+        # some field may be added to an existing property
+        if any('p' in self._get_option_with_fallback(options, 'exists')
+               for prop, options in self.fields.values()):
+            self._field_pids = None
+        else:
+            self._field_pids = frozenset(
+                prop.upper() for prop, options in self.fields.values())
+        self._find_synonyms_and_datatypes()
         self.linkR = textlib.compileLinkR()
+        self._type_handlers = {
+            'wikibase-item': self._handle_item,
+            'string': self._handle_string,
+            'external-id': self._handle_string,
+            'url': self._handle_url,
+            'commonsMedia': self._handle_commons,
+        }
+        self._link_cache = OrderedDict()
+        self._commons = pywikibot.Site('commons', 'commons')
+        self._commons_cache = OrderedDict()
+        self._template_names = {}
         self.create_missing_item = self.getOption('create')
 
+    def _find_synonyms_and_datatypes(self):
+        """Find the template's redirects while fetching property types."""
+        synonyms = {}
+
+        def find_synonyms():
+            try:
+                synonyms['titles'] = self.getTemplateSynonyms(
+                    self.templateTitle)
+            except BaseException as e:  # exit() if there is no template
+                synonyms['error'] = e
+
+        thread = threading.Thread(target=find_synonyms)
+        thread.start()
+        try:
+            # Claims are created with the type, so it isn't looked up from
+            # the API cache on every field
+            self._datatypes = dict(
+                (prop.upper(), pywikibot.PropertyPage(self.repo, prop).type)
+                for prop, options in self.fields.values())
+        finally:
+            thread.join()
+        if 'error' in synonyms:
+            raise synonyms['error']
+        self.templateTitles = synonyms['titles']
+
     def getTemplateSynonyms(self, title):
-        """Fetch redirects of the title, so we can check against them."""
+        """
+        Fetch redirects of the title, so we can check against them.
+
+        @return: titles of the template and its redirects without namespace
+        @rtype: frozenset
+        """
         temp = pywikibot.Page(pywikibot.Site(), title, ns=10)
         if not temp.exists():
             pywikibot.error(u'Template %s does not exist.' % temp.title())
@@ -177,22 +299,106 @@ class HarvestRobot(WikidataBot):
                                                  namespaces=[10],
                                                  follow_redirects=False)]
         titles.append(temp.title(withNamespace=False))
-        return titles
+        return frozenset(titles)
+
+    def getSource(self, site):
+        """
+        Create a Claim usable as a source, fetching the sources on first use.
+
+        @see: L{WikidataBot.getSource}
+        """
+        if not hasattr(self, 'source_values'):
+            self.cacheSources()
+        return super(HarvestRobot, self).getSource(site)
 
     def _template_link_target(self, item, link_text):
         link = pywikibot.Link(link_text)
         try:
-            linked_page = pywikibot.Page(link)
+            key = (link.site, link.canonical_title())
         except pywikibot.exceptions.InvalidTitle:
             pywikibot.error('%s is not a valid title so it cannot be linked. '
                             'Skipping.' % link_text)
             return
 
+        # The same pages are usually linked from many pages, so the id of
+        # the target is remembered; only the self-link check depends on
+        # the item.
+        if key in self._link_cache:
+            qid = self._cached(self._link_cache, key)
+        else:
+            qid = self._link_item_id(pywikibot.Page(link))
+            self._cache(self._link_cache, key, qid)
+
+        if not qid:
+            return
+
+        if qid == item.getID():
+            pywikibot.output('%s links to itself. Skipping.' % link_text)
+            return
+
+        return pywikibot.ItemPage(self.repo, qid)
+
+    def _cached(self, cache, key):
+        """Return a remembered value and mark it as recently used."""
+        value = cache.pop(key)
+        cache[key] = value
+        return value
+
+    def _cache(self, cache, key, value):
+        """Remember a resolved value, dropping the least recently used."""
+        if len(cache) >= self.link_cache_size:
+            cache.popitem(last=False)
+        cache[key] = value
+
+    def _resolve_links_batch(self, link_texts):
+        """
+        Resolve the items of links which aren't cached yet.
+
+        The info and pageprops of the linked pages, but not their content,
+        are loaded and the item ids found in the pageprops are checked, so
+        the links need a request per groupsize pages instead of several per
+        link. Only redirects and stale pageprops are resolved one by one.
+
+        @param link_texts: texts of the links to resolve
+        @type link_texts: list
+        """
+        pages = {}
+        for link_text in link_texts:
+            link = pywikibot.Link(link_text)
+            try:
+                key = (link.site, link.canonical_title())
+            except pywikibot.exceptions.InvalidTitle:
+                continue  # reported by _template_link_target
+            if key not in self._link_cache and key not in pages:
+                pages[key] = pywikibot.Page(link)
+
+        sites = {}
+        for key, page in pages.items():
+            sites.setdefault(page.site, {})[key] = page
+        for site, site_pages in sites.items():
+            self._load_page_info(site, list(site_pages.values()))
+            item_ids = self._existing_item_ids(site, site_pages.values())
+            for key, page in site_pages.items():
+                self._cache(self._link_cache, key,
+                            self._link_item_id(page, item_ids))
+
+    def _link_item_id(self, linked_page, item_ids=None):
+        """
+        Return the id of the item of the linked page or None.
+
+        @param item_ids: the ids of existing items by the id in the
+            pageprops, as returned by _existing_item_ids
+        @type item_ids: dict or None
+        """
         if not linked_page.exists():
             pywikibot.output('%s does not exist so it cannot be linked. '
                              'Skipping.' % (linked_page))
             return
 
+        qid = getattr(linked_page, '_pageprops', {}).get('wikibase_item')
+        if item_ids and qid in item_ids:
+            return item_ids[qid]
+
         if linked_page.isRedirectPage():
             linked_page = linked_page.getRedirectTarget()
 
@@ -206,11 +412,94 @@ class HarvestRobot(WikidataBot):
                              'Skipping.' % (linked_page))
             return
 
-        if linked_item.title() == item.title():
-            pywikibot.output('%s links to itself. Skipping.' % (linked_page))
+        return linked_item.getID()
+
+    def _commons_target(self, value):
+        """Return the existing file on Commons named by value or None."""
+        imagelink = pywikibot.Link(
+            value, source=self._commons, defaultNamespace=6)
+        try:
+            key = imagelink.canonical_title()
+        except (pywikibot.exceptions.InvalidTitle, ValueError):
+            pywikibot.error('%s is not a valid file name. Skipping.' % value)
             return
 
-        return linked_item
+        if key in self._commons_cache:
+            title = self._cached(self._commons_cache, key)
+        else:
+            title = self._file_title(pywikibot.FilePage(imagelink))
+            self._cache(self._commons_cache, key, title)
+
+        if title:
+            return pywikibot.FilePage(self._commons, title)
+
+    def _resolve_files_batch(self, values):
+        """
+        Resolve the files on Commons which aren't cached yet.
+
+        The info of the file pages, but not their content, is loaded so
+        that their existence is known with a request per groupsize files.
+        Only redirects are followed one by one.
+
+        @param values: names of the files to resolve
+        @type values: list
+        """
+        images = {}
+        for value in values:
+            imagelink = pywikibot.Link(
+                value, source=self._commons, defaultNamespace=6)
+            try:
+                key = imagelink.canonical_title()
+                if key not in self._commons_cache and key not in images:
+                    images[key] = pywikibot.FilePage(imagelink)
+            except (pywikibot.exceptions.InvalidTitle, ValueError):
+                continue  # reported by _commons_target
+
+        if not images:
+            return
+
+        self._load_page_info(self._commons, list(images.values()))
+        for key, image in images.items():
+            self._cache(self._commons_cache, key, self._file_title(image))
+
+    def _file_title(self, image):
+        """Return the title of the file or its redirect target or None."""
+        if image.isRedirectPage():
+            image = pywikibot.FilePage(image.getRedirectTarget())
+        if not image.exists():
+            pywikibot.output(
+                "{0} doesn't exist. I can't link to it"
+                ''.format(image.title(asLink=True)))
+            return
+
+        return image.title()
+
+    def _template_name(self, site, template):
+        """Return the title of the template without namespace."""
+        # The same few names occur on every page
+        key = (site, template)
+        if key not in self._template_names:
+            self._template_names[key] = pywikibot.Page(
+                site, template, ns=10).title(withNamespace=False)
+        return self._template_names[key]
+
+    def _handle_item(self, value, item):
+        """Return the item linked by value or None."""
+        return self._template_link_target(item, value)
+
+    def _handle_string(self, value, item):
+        """Return value as a string target."""
+        return value.strip()
+
+    def _handle_url(self, value, item):
+        """Return the first external link in value or None."""
+        match = self.linkR.search(value)
+        if match:
+            return match.group('url')
+
+    def _handle_commons(self, value, item):
+        """Return the file on Commons named by value or None."""
+        return self._commons_target(value)
 
     def _get_option_with_fallback(self, handler, option):
         """
@@ -225,17 +514,206 @@ class HarvestRobot(WikidataBot):
         else:
             return local or default
 
+    def _groupsize(self, site):
+        """Return how many pages or items may be requested at once."""
+        if site.logged_in() and site.has_right('apihighlimits'):
+            return self.high_groupsize
+        return self.groupsize
+
+    def _preload_chunk(self, pages):
+        """
+        Preload the pages together with their items.
+
+        The items are attached to the pages so that ItemPage.fromPage
+        and item.get() don't need to query the repository again.
+
+        @param pages: pages of the same site to preload
+        @type pages: list
+        @return: the preloaded pages
+        @rtype: generator
+        """
+        site = pages[0].site
+        pages = list(site.preloadpages(pages, groupsize=self._groupsize(site),
+                                       pageprops=True))
+        self._attach_items(site, pages)
+        for page in pages:
+            yield page
+
+    def _load_page_info(self, site, pages):
+        """
+        Load the info and pageprops of pages without their content.
+
+        Pages which the response doesn't cover are loaded on demand.
+
+        @param site: site of the pages
+        @type site: pywikibot.site.APISite
+        @param pages: pages to load
+        @type pages: list
+        """
+        titles = dict((page.title(withSection=False), page) for page in pages)
+        for group in itergroup(list(titles), self._groupsize(site)):
+            gen = api.PropertyGenerator('info|pageprops', site=site,
+                                        parameters={'titles': group})
+            for pagedata in gen:
+                page = titles.get(pagedata.get('title'))
+                if page is None:
+                    continue
+                try:
+                    api.update_page(page, pagedata, gen.props)
+                except (pywikibot.exceptions.InvalidTitle,
+                        pywikibot.exceptions.UnsupportedPage):
+                    continue
+
+    def _existing_item_ids(self, site, pages):
+        """
+        Check the items of the pages according to their pageprops.
+
+        Only the info of the items is requested, as the linked items
+        themselves aren't needed. Pageprops of missing items are removed.
+
+        @param site: site of the pages
+        @type site: pywikibot.site.APISite
+        @param pages: pages with loaded pageprops
+        @type pages: iterable
+        @return: the ids of the existing items, redirects resolved, by the
+            id in the pageprops
+        @rtype: dict
+        """
+        repo = site.data_repository()
+        ids = {}
+        for page in pages:
+            qid = getattr(page, '_pageprops', {}).get('wikibase_item')
+            if qid:
+                ids.setdefault(qid, []).append(page)
+
+        item_ids = {}
+        for group in itergroup(list(ids), self._groupsize(repo)):
+            data = api.Request(site=repo, parameters={
+                'action': 'wbgetentities', 'ids': group,
+                'props': 'info'}).submit()
+            for qid, content in data['entities'].items():
+                if 'missing' not in content:
+                    item_ids[content.get('redirects', {}).get(
+                        'from', qid)] = content.get('id', qid)
+
+        for qid, qid_pages in ids.items():
+            if qid not in item_ids:
+                # The pageprop is stale, let ItemPage.fromPage look up the
+                # item by the sitelink instead
+                for page in qid_pages:
+                    del page._pageprops['wikibase_item']
+        return item_ids
+
+    def _attach_items(self, site, pages):
+        """
+        Attach the items of the pages according to their pageprops.
+
+        The items are loaded in groups, so that ItemPage.fromPage and
+        item.get() don't need to query the repository for each page.
+
+        @param site: site of the pages
+        @type site: pywikibot.site.APISite
+        @param pages: pages with loaded pageprops
+        @type pages: list
+        """
+        repo = site.data_repository()
+        ids = {}
+        for page in pages:
+            qid = getattr(page, '_pageprops', {}).get('wikibase_item')
+            if qid:
+                ids.setdefault(qid, []).append(page)
+
+        items = self._load_items(repo, list(ids)) if ids else {}
+        for qid, qid_pages in ids.items():
+            for page in qid_pages:
+                if qid in items:
+                    page._item = items[qid]
+                else:
+                    # The pageprop is stale, let ItemPage.fromPage look up
+                    # the item by the sitelink instead
+                    del page._pageprops['wikibase_item']
+
+    def _load_items(self, repo, ids):
+        """
+        Load the items with the given ids.
+
+        Unlike DataSite.preloaditempages, missing items are left out
+        instead of raising NoPage, as pageprops may still refer to deleted
+        items.
+
+        @param repo: data repository of the items
+        @type repo: pywikibot.site.DataSite
+        @param ids: ids of the items
+        @type ids: list
+        @return: the existing items by requested id
+        @rtype: dict
+        """
+        items = {}
+        for group in itergroup(ids, self._groupsize(repo)):
+            data = api.Request(site=repo, parameters={
+                'action': 'wbgetentities', 'ids': group}).submit()
+            for qid, content in data['entities'].items():
+                if 'missing' in content:
+                    continue
+                item = pywikibot.ItemPage(repo, qid)
+                item._content = content
+                # No api call is made because item._content is given
+                item.get(get_redirect=True)
+                items[content.get('redirects', {}).get('from', qid)] = item
+        return items
+
+    def _preloaded_pages(self, generator):
+        """Yield the pages of the generator with their items preloaded."""
+        # A generator might yield pages from multiple sites
+        sites = {}
+        for page in generator:
+            site = page.site
+            sites.setdefault(site, []).append(page)
+            if len(sites[site]) >= self._groupsize(site):
+                for page in self._preload_chunk(sites.pop(site)):
+                    yield page
+        for pages in sites.values():
+            for page in self._preload_chunk(pages):
+                yield page
+
+    def run(self):
+        """Treat pages while the next ones are fetched in the background."""
+        generator = self.generator
+        self.generator = _PrefetchingGenerator(target=self._preloaded_pages,
+                                               args=(generator,),
+                                               qsize=self.prefetch)
+        try:
+            super(HarvestRobot, self).run()
+        finally:
+            self.generator.stop()
+            self.generator = generator
+
     def treat_page_and_item(self, page, item):
         """Process a single page/item."""
-        if willstop:
+        if self._state.stop:
             raise KeyboardInterrupt
 
-        templates = page.raw_extracted_templates
+        link_search = pywikibot.link_regex.search
+        existing_claims = item.get().get('claims')
+        if (self._field_pids is not None and
+                self._field_pids.issubset(existing_claims)):
+            pywikibot.output('%s already has all harvested properties. '
+                             'Skipping.' % item)
+            return
+
+        harvested = []
+        link_texts = []
+        file_names = []
+        try:
+            templates = textlib.extract_templates_and_params_by_title(
+                page.text, self.templateTitles)
+        except ValueError:
+            # Let the parser make sense of the broken markup
+            templates = page.raw_extracted_templates
         for (template, fielddict) in templates:
             # Clean up template
             try:
-                template = pywikibot.Page(page.site, template,
-                                          ns=10).title(withNamespace=False)
+                template = self._template_name(page.site, template)
             except pywikibot.exceptions.InvalidTitle:
                 pywikibot.error(
                     "Failed parsing template; '%s' should be the template name."
@@ -256,56 +734,52 @@ class HarvestRobot(WikidataBot):
 
                 # This field contains something useful for us
                 prop, options = self.fields[field]
-                claim = pywikibot.Claim(self.repo, prop)
+                claim = pywikibot.Claim(
+                    self.repo, prop, datatype=self._datatypes[prop.upper()])
+                exists_arg = self._get_option_with_fallback(options, 'exists')
+                if 'p' not in exists_arg and claim.getID() in existing_claims:
+                    # Don't resolve a value which would be skipped anyway
+                    pywikibot.output(
+                        'Skipping %s because claim with same property '
+                        'already exists' % claim.getID())
+                    continue
+
                 if claim.type == 'wikibase-item':
                     # Try to extract a valid page
-                    match = pywikibot.link_regex.search(value)
+                    match = link_search(value)
                     if match:
-                        link_text = match.group(1)
-                    else:
-                        if self._get_option_with_fallback(options, 'islink'):
-                            link_text = value
-                        else:
-                            pywikibot.output(
-                                '%s field %s value %s is not a wikilink. '
-                                'Skipping.' % (claim.getID(), field, value))
-                            continue
-
-                    linked_item = self._template_link_target(item, link_text)
-                    if not linked_item:
-                        continue
-
-                    claim.setTarget(linked_item)
-                elif claim.type in ('string', 'external-id'):
-                    claim.setTarget(value.strip())
-                elif claim.type == 'url':
-                    match = self.linkR.search(value)
-                    if not match:
-                        continue
-                    claim.setTarget(match.group('url'))
-                elif claim.type == 'commonsMedia':
-                    commonssite = pywikibot.Site('commons', 'commons')
-                    imagelink = pywikibot.Link(
-                        value, source=commonssite, defaultNamespace=6)
-                    image = pywikibot.FilePage(imagelink)
-                    if image.isRedirectPage():
-                        image = pywikibot.FilePage(image.getRedirectTarget())
-                    if not image.exists():
+                        value = match.group(1)
+                    elif not self._get_option_with_fallback(options, 'islink'):
                         pywikibot.output(
-                            "{0} doesn't exist. I can't link to it"
-                            ''.format(image.title(asLink=True)))
+                            '%s field %s value %s is not a wikilink. '
+                            'Skipping.' % (claim.getID(), field, value))
                         continue
-                    claim.setTarget(image)
-                else:
-                    pywikibot.output('%s is not a supported datatype.'
-                                     % claim.type)
-                    continue
+                    link_texts.append(value)
+                elif claim.type == 'commonsMedia':
+                    file_names.append(value)
+
+                harvested.append((claim, value, exists_arg))
+
+        # Resolve the links and files of all fields at once
+        self._resolve_links_batch(link_texts)
+        self._resolve_files_batch(file_names)
+
+        for claim, value, exists_arg in harvested:
+            handler = self._type_handlers.get(claim.type)
+            if handler is None:
+                pywikibot.output('%s is not a supported datatype.'
+                                 % claim.type)
+                continue
+
+            target = handler(value, item)
+            if target is None:
+                continue
+
+            claim.setTarget(target)
 
-                # A generator might yield pages from multiple sites
-                self.user_add_claim_unless_exists(
-                    item, claim, self._get_option_with_fallback(
-                        options, 'exists'),
-                    page.site, pywikibot.output)
+            # A generator might yield pages from multiple sites
+            self.user_add_claim_unless_exists(
+                item, claim, exists_arg, page.site, pywikibot.output)
 
 
 def main(*args):
@@ -375,12 +849,14 @@ def main(*args):
             'Please specify either -template or -transcludes argument')
         return
 
-    generator = gen.getCombinedGenerator(preload=True)
+    # pages are preloaded by the bot together with their items
+    generator = gen.getCombinedGenerator()
     if not generator:
         gen.handleArg(u'-transcludes:' + template_title)
-        generator = gen.getCombinedGenerator(preload=True)
+        generator = gen.getCombinedGenerator()
 
     bot = HarvestRobot(generator, template_title, fields, **options)
+    signal.signal(signal.SIGINT, _signal_handler)
     bot.run()
 
 
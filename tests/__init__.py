@@ -140,6 +140,7 @@ script_test_modules = [
     'data_ingestion',
     'deletionbot',
     'disambredir',
+    'harvest_template',
     'isbn',
     'protectbot',
     'reflinks',
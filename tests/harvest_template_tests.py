@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Tests for harvest_template script."""
+#
+# (C) Pywikibot team, 2018
+#
+# Distributed under the terms of the MIT license.
+#
+from __future__ import absolute_import, unicode_literals
+
+import pywikibot
+
+from pywikibot import config
+from pywikibot.data import api
+
+from scripts.harvest_template import (
+    _PrefetchingGenerator, HarvestRobot, PropertyOptionHandler,
+)
+
+from tests import mock
+from tests.aspects import unittest, TestCase
+from tests.utils import DrySite
+
+
+class TestPrefetchingGenerator(TestCase):
+
+    """Test the look-ahead generator of HarvestRobot."""
+
+    net = False
+
+    def test_values(self):
+        """Test that all values are yielded."""
+        gen = _PrefetchingGenerator(target=range, args=(20, ))
+        self.assertEqual(list(gen), list(range(20)))
+        self.assertTrue(gen.finished.is_set())
+
+    def test_daemon(self):
+        """Test that the thread doesn't keep the interpreter alive."""
+        gen = _PrefetchingGenerator(target=range, args=(20, ))
+        self.assertTrue(gen.daemon)
+
+    def test_exception(self):
+        """Test that an exception of the generator is re-raised."""
+        def failing():
+            yield 1
+            raise ValueError('preloading failed')
+
+        gen = _PrefetchingGenerator(target=failing)
+        values = []
+        with self.assertRaisesRegex(ValueError, 'preloading failed'):
+            for value in gen:
+                values.append(value)
+        self.assertEqual(values, [1])
+        gen.join(5)
+        self.assertFalse(gen.is_alive())
+
+
+def _find_synonyms_and_datatypes(bot):
+    """Set the template titles and property types without requests."""
+    bot.templateTitles = frozenset(['Infobox person'])
+    bot._datatypes = {'P21': 'wikibase-item', 'P18': 'commonsMedia'}
+
+
+def _entity(qid, **kwargs):
+    """Return the content of an empty item like wbgetentities."""
+    content = {'type': 'item', 'id': qid, 'lastrevid': 1, 'labels': {},
+               'descriptions': {}, 'aliases': {}, 'claims': {},
+               'sitelinks': {}}
+    content.update(kwargs)
+    return content
+
+
+class TestHarvestRobot(TestCase):
+
+    """Test HarvestRobot without a connection to the wikis."""
+
+    family = 'wikipedia'
+    code = 'en'
+
+    dry = True
+
+    def setUp(self):
+        """Load the sites created by HarvestRobot as dry sites."""
+        super(TestHarvestRobot, self).setUp()
+        self._patchers = [
+            mock.patch.object(config, 'site_interface', DrySite),
+            mock.patch.object(config, 'family', self.family),
+            mock.patch.object(config, 'mylang', self.code),
+            mock.patch.object(HarvestRobot, '_find_synonyms_and_datatypes',
+                              _find_synonyms_and_datatypes),
+        ]
+        for patcher in self._patchers:
+            patcher.start()
+
+    def tearDown(self):
+        """Restore the site interface before the dry site mixin does."""
+        for patcher in reversed(self._patchers):
+            patcher.stop()
+        super(TestHarvestRobot, self).tearDown()
+
+    def _bot(self, fields=None, **kwargs):
+        """Return a HarvestRobot harvesting the fields."""
+        if fields is None:
+            fields = {'sex': ('P21', PropertyOptionHandler()),
+                      'image': ('P18', PropertyOptionHandler())}
+        return HarvestRobot(iter([]), 'Infobox person', fields, **kwargs)
+
+    def _page(self, title, qid):
+        """Return a page with the item id in its pageprops."""
+        page = pywikibot.Page(self.get_site(), title)
+        page._pageprops = {'wikibase_item': qid}
+        return page
+
+    def test_attach_items(self):
+        """Test attaching existing, redirected and missing items."""
+        bot = self._bot()
+        pages = [self._page('Foo', 'Q1'), self._page('Bar', 'Q2'),
+                 self._page('Baz', 'Q4')]
+        data = {'entities': {
+            'Q1': _entity('Q1'),
+            'Q3': _entity('Q3', redirects={'from': 'Q2', 'to': 'Q3'}),
+            'Q4': {'id': 'Q4', 'missing': ''},
+        }}
+        with mock.patch.object(api.Request, 'submit',
+                               return_value=data) as submit:
+            bot._attach_items(self.get_site(), pages)
+        self.assertEqual(submit.call_count, 1)
+
+        self.assertEqual(pages[0]._item.getID(), 'Q1')
+        self.assertEqual(pages[1]._item.getID(), 'Q3')
+        self.assertEqual(pages[1]._pageprops, {'wikibase_item': 'Q2'})
+        # The stale pageprop is dropped to look up the item by sitelink
+        self.assertFalse(hasattr(pages[2], '_item'))
+        self.assertEqual(pages[2]._pageprops, {})
+
+    def test_load_items(self):
+        """Test that missing items are left out instead of raising."""
+        bot = self._bot()
+        data = {'entities': {
+            'Q3': _entity('Q3', redirects={'from': 'Q2', 'to': 'Q3'}),
+            'Q4': {'id': 'Q4', 'missing': ''},
+        }}
+        with mock.patch.object(api.Request, 'submit', return_value=data):
+            items = bot._load_items(bot.repo, ['Q2', 'Q4'])
+        self.assertEqual(list(items), ['Q2'])
+        self.assertEqual(items['Q2'].getID(), 'Q3')
+        self.assertEqual(items['Q2'].claims, {})
+
+    def test_skip_existing_properties(self):
+        """Test that items with all harvested properties are skipped."""
+        bot = self._bot()
+        self.assertEqual(bot._field_pids, frozenset(['P21', 'P18']))
+        page = mock.Mock()
+        type(page).text = text = mock.PropertyMock(return_value='')
+        item = mock.Mock()
+        item.get.return_value = {'claims': {'P18': [], 'P21': [],
+                                            'P31': []}}
+        bot.treat_page_and_item(page, item)
+        self.assertFalse(text.called)
+
+        item.get.return_value = {'claims': {'P21': []}}
+        bot.treat_page_and_item(page, item)
+        text.assert_called_once_with()
+
+    def test_skip_existing_properties_exists_p(self):
+        """Test that items aren't skipped if properties may be added to."""
+        bots = [
+            self._bot(exists='p'),
+            self._bot({'sex': ('P21', PropertyOptionHandler(exists='p')),
+                       'image': ('P18', PropertyOptionHandler())}),
+        ]
+        for bot in bots:
+            self.assertIsNone(bot._field_pids)
+            page = mock.Mock()
+            type(page).text = text = mock.PropertyMock(return_value='')
+            item = mock.Mock()
+            item.get.return_value = {'claims': {'P18': [], 'P21': []}}
+            bot.treat_page_and_item(page, item)
+            text.assert_called_once_with()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    try:
+        unittest.main()
+    except SystemExit:
+        pass
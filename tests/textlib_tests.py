@@ -658,6 +658,90 @@ class TestTemplateParams(TestCase):
         self.assertTrue(m.group(0).endswith('foo {{bar}}'))
 
 
+@require_modules('mwparserfromhell')
+class TestTemplateParamsByTitle(TestCase):
+
+    """Test extracting templates by title like the parser does."""
+
+    net = False
+
+    titles = ('Infobox person', 'Foo')
+
+    def _is_titled(self, name):
+        """Return whether the template name has one of the titles."""
+        name = re.sub('[ _]+', ' ', name.split(':')[-1]).strip().lower()
+        return name in [title.lower() for title in self.titles]
+
+    def assert_same_templates(self, text):
+        """Assert that the result equals the filtered parser result."""
+        expected = [(name, params) for name, params
+                    in textlib.extract_templates_and_params(text, True, True)
+                    if self._is_titled(name)]
+        self.assertEqual(
+            textlib.extract_templates_and_params_by_title(text, self.titles),
+            expected)
+
+    def test_simple(self):
+        """Test templates without special markup."""
+        self.assert_same_templates('{{Infobox person}}')
+        self.assert_same_templates('a {{Infobox person|a|b=c| d = e }} f')
+        self.assert_same_templates('{{Infobox person|b|1=c|=d|e=}}')
+        self.assert_same_templates('{{Foo|a}}{{Bar|b}}{{Foo|c}}')
+
+    def test_nested(self):
+        """Test nested templates."""
+        self.assert_same_templates('{{Infobox person|a={{b|c}}|d={{e|}}}}')
+        self.assert_same_templates('{{Infobox person|a={{Foo|b=c}}|d}}')
+        self.assert_same_templates(
+            '{{Infobox person|a={{b|{{c|d}}}}|e=f}}')
+        self.assert_same_templates('{{Infobox person|a={{b|c}}}|d}}')
+
+    def test_links(self):
+        """Test links with pipes."""
+        self.assert_same_templates('{{Infobox person|a=[[b|c]]|d=e}}')
+        self.assert_same_templates('{{Infobox person|[[b|c=d]]|e}}')
+        self.assert_same_templates('{{Foo|a=[[File:b.jpg|thumb|c]]}}')
+
+    def test_triple_braces(self):
+        """Test template parameters in templates."""
+        self.assert_same_templates('{{Infobox person|a={{{1|}}}}}')
+        self.assert_same_templates('{{Infobox person|a={{{1|b=c}}}|d}}')
+        self.assert_same_templates('{{Infobox person|{{{a}}}={{{b}}}}}')
+        self.assert_same_templates('{{{Foo|x}}}')
+        self.assert_same_templates('{{{a|{{Foo|x}}}}}')
+        self.assert_same_templates('a{{{Foo}}}{{Foo|b}}')
+
+    def test_tags(self):
+        """Test pipes and equal signs in tags."""
+        self.assert_same_templates('{{Infobox person|z<ref name=q/>|y=1}}')
+        self.assert_same_templates(
+            '{{Infobox person|a=b<ref name="c">d|e=f</ref>|g}}')
+        self.assert_same_templates('{{Infobox person|a=<small>b|c</small>}}')
+        self.assert_same_templates('{{Infobox person|a<br />|b=c<br>}}')
+
+    def test_prefixes(self):
+        """Test namespace prefixes and different spelling."""
+        self.assert_same_templates('{{Template:Infobox person|a=b}}')
+        self.assert_same_templates('{{template:Infobox_person|a=b}}')
+        self.assert_same_templates('{{ infobox  person\n| a = b\n}}')
+        self.assert_same_templates('{{Infobox person <!-- c -->|a=b}}')
+        self.assert_same_templates('{{Infobox personal|a=b}}')
+
+    def test_unclosed(self):
+        """Test that unclosed templates raise ValueError."""
+        func = functools.partial(
+            textlib.extract_templates_and_params_by_title,
+            titles=self.titles)
+        self.assertRaises(ValueError, func, '{{Infobox person|a')
+        self.assertRaises(ValueError, func, '{{Infobox person|a={{b|c}}')
+        self.assertRaises(ValueError, func, '{{Infobox person|a=[[b|c}}')
+
+    def test_prefix_performance(self):
+        """Test that many colons don't cause catastrophic backtracking."""
+        self.assertEqual(textlib.extract_templates_and_params_by_title(
+            '{{' + 'a: ' * 10000 + 'b}}', self.titles), [])
+
+
 class TestGenericTemplateParams(PatchingTestCase):
 
     """Test whether the generic function forwards the call correctly."""